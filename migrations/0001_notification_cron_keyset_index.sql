@@ -0,0 +1,5 @@
+-- PostgresProducer.scan_table pages notification_cron by (updated_at, id),
+-- the index gives it an ordered index scan instead of a sort.
+-- CONCURRENTLY can't run inside a transaction, apply it as a single statement.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS notification_cron_updated_at_id_idx
+    ON notifications.notification_cron (updated_at, id);
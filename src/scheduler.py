@@ -1,7 +1,9 @@
 """Watching over cron tables to launch jobs"""
+import asyncio
 import logging
 import os
-from time import sleep
+
+import uvloop
 
 from scheduler.cleaners import Cleaner, PostgresCleaner
 from scheduler.config.settings import settings
@@ -12,6 +14,7 @@ from scheduler.connections import (
     RedisConnector,
 )
 from scheduler.exceptions import Error
+from scheduler.models import CronEntry
 from scheduler.producers import PostgresProducer, Producer
 from scheduler.schedulers import NotificationScheduler, Scheduler
 from scheduler.state import RedisStorage, State
@@ -24,21 +27,74 @@ class ScheduleManager:
     producer: Producer
     scheduler: Scheduler
     cleaner: Cleaner
+    state: State
 
-    def schedule(self):
-        for table, to_be_scheduled, to_be_deleted in self.producer.scan(
-            settings.tables_for_scan
-        ):
-            logging.debug(f"Watching table {table}")
+    async def schedule(self):
+        to_be_cleaned: dict[str, list[CronEntry]] = {}
+        # tables are independent, half of the pool is left for the rest
+        semaphore = asyncio.Semaphore(max(settings.postgres_pool_max_size // 2, 1))
+
+        tables = settings.tables_for_scan
+        results = await asyncio.gather(
+            *(
+                self.process_table(table, pack_size, to_be_cleaned, semaphore)
+                for table, pack_size in tables
+            ),
+            return_exceptions=True,
+        )
+        for (table, _), result in zip(tables, results):
+            if isinstance(result, BaseException):
+                logging.error("Scan of %s failed", table, exc_info=result)
+
+        await self.commit(to_be_cleaned)
+        logging.info("Pending...")
+
+    async def process_table(
+        self,
+        table: str,
+        pack_size: int,
+        to_be_cleaned: dict[str, list[CronEntry]],
+        semaphore: asyncio.Semaphore,
+    ):
+        async with semaphore:
+            logging.debug("Watching table %s", table)
+            async for to_be_scheduled, to_be_deleted in self.producer.scan_table(
+                table, pack_size
+            ):
+                try:
+                    self.scheduler.apply(to_be_deleted, to_be_scheduled)
+                except Error as e:
+                    logging.error(e)
+                    continue
+                to_be_cleaned.setdefault(table, []).extend(to_be_deleted)
+                self.producer.set_state(table)
+
+    async def commit(self, to_be_cleaned: dict[str, list[CronEntry]]):
+        """
+        Write cron file once per pass, then delete rows and save state
+
+        Rows are deleted and state is advanced only after the cron file no
+        longer needs them, so a crash in between makes the next pass read
+        the same rows again.
+        """
+
+        try:
+            # writing the cron file blocks
+            await asyncio.get_running_loop().run_in_executor(None, self.scheduler.flush)
+        except (Error, OSError) as e:
+            logging.error(e)
+            for table in to_be_cleaned:
+                self.producer.drop_state(table)
+            return
+
+        for table, entries in to_be_cleaned.items():
             try:
-                self.scheduler.unschedule(to_be_deleted)
-                self.scheduler.schedule(to_be_scheduled)
-                self.cleaner.clean(table, to_be_deleted)
+                await self.cleaner.clean(table, entries)
             except Error as e:
                 logging.error(e)
-                continue
-            self.producer.set_state(table)
-        logging.info("Pending...")
+                self.producer.drop_state(table)
+
+        await self.state.flush()
 
 
 class PostgresScheduleManager(ScheduleManager):
@@ -54,29 +110,34 @@ class PostgresScheduleManager(ScheduleManager):
         self.cleaner = PostgresCleaner(self.postgres)
 
 
-def schedule():
-    """Основной метод, планирующий уведомления"""
-
+async def _schedule():
     logging.debug("Beginning the extraction process...")
     logging.debug("Trying to establsh connection with db...")
 
-    while True:
-        try:
-            postgres_manager = PostgresConnectionManager(PostgresConnector())
-            redis_manager = RedisConnectionManager(RedisConnector())
-            with (postgres_manager as postgres, redis_manager as redis):
-                manager = PostgresScheduleManager(postgres, redis)
-                manager.schedule()
-                del manager
-
-            logging.debug("Sleeping...")
-            sleep(settings.wait_up_to)
-
-        except Exception as e:
-            logging.error(type(e))
-            logging.error(e)
-            logging.error("Exited scan...")
-            return
+    try:
+        # pools live for the whole process, connections are reused every cycle
+        async with (
+            PostgresConnectionManager(PostgresConnector()) as postgres,
+            RedisConnectionManager(RedisConnector()) as redis,
+        ):
+            manager = PostgresScheduleManager(postgres, redis)
+            while True:
+                await manager.schedule()
+
+                logging.debug("Sleeping...")
+                await asyncio.sleep(settings.wait_up_to)
+
+    except Exception as e:
+        logging.error(type(e))
+        logging.error(e)
+        logging.error("Exited scan...")
+
+
+def schedule():
+    """Основной метод, планирующий уведомления"""
+
+    uvloop.install()
+    asyncio.run(_schedule())
 
 
 if __name__ == "__main__":
@@ -1,9 +1,13 @@
 from abc import ABC, abstractmethod
 from typing import Iterable
 
+from .config.settings import settings
 from .connections import ConnectionManager, PostgresConnectionManager
+from .exceptions import UnknownTableError
 from .models import CronEntry
 
+COPY_TABLE = "cleaner_ids"
+
 
 def scan(tables, scanning_method) -> Iterable[tuple[str, Iterable, Iterable]]:
     for table_name, items in tables:
@@ -17,7 +21,7 @@ class Cleaner(ABC):
         self.manager: ConnectionManager = manager
 
     @abstractmethod
-    def clean(self, table: str, entries: Iterable[CronEntry]):
+    async def clean(self, table: str, entries: Iterable[CronEntry]):
         ...
 
 
@@ -25,8 +29,33 @@ class PostgresCleaner(Cleaner):
     def __init__(self, manager: PostgresConnectionManager):
         super().__init__(manager)
         self.manager: PostgresConnectionManager = manager
-
-    def clean(self, table: str, entries: Iterable[CronEntry]):
-        ids = tuple(entry.id for entry in entries)
-
-        self.manager.execute(f"delete from {table} where id in {ids}")
+        # table name can't be a bind parameter, so only known tables get in sql
+        self.sql = {
+            table: f"delete from {table} where id = any($1::uuid[])"
+            for table, _ in settings.tables_for_scan
+        }
+        self.sql_using = {
+            table: f"delete from {table} t using {COPY_TABLE} c where t.id = c.id"
+            for table, _ in settings.tables_for_scan
+        }
+
+    async def clean(self, table: str, entries: Iterable[CronEntry]):
+        if table not in self.sql:
+            raise UnknownTableError(f"Table {table} is not scanned")
+
+        ids = [entry.id for entry in entries]
+        if not ids:
+            return
+
+        if len(ids) < settings.clean_copy_threshold:
+            # asyncpg prepares the statement once per connection and reuses it
+            await self.manager.execute(self.sql[table], (ids,))
+            return
+
+        # too big for one array parameter, ids are copied to a temporary table
+        await self.manager.copy_and_execute(
+            f"create temporary table {COPY_TABLE} (id uuid) on commit drop",
+            COPY_TABLE,
+            [(id_,) for id_ in ids],
+            self.sql_using[table],
+        )
@@ -14,12 +14,20 @@ class Settings(pydantic.BaseSettings):
     postgres_password: str
     postgres_host: str
     postgres_port: str
+    postgres_pool_min_size: int = 2
+    postgres_pool_max_size: int = 10
+    postgres_pool_max_inactive: float = 300
 
     redis_host: str
     redis_port: int
+    redis_pool_max_size: int = 10
 
     tables_for_scan: list[tuple[str, int]] = [("notifications.notification_cron", 1000)]
     cron_command: str = "/send"
+    cron_file: str = "/etc/cron.d/movix"
+    cron_user: str = "root"
+    # deletes of at least that many ids go through COPY to a temporary table
+    clean_copy_threshold: int = 10000
 
     wait_up_to: int = 60 * 60 * 12
     waiting_interval: int = 60 * 30
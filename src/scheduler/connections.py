@@ -1,45 +1,39 @@
 import logging
 from abc import ABC, abstractmethod
-from contextlib import closing
-from functools import wraps
-from time import sleep
+from asyncio import sleep
 from typing import Any, Callable, Iterable, cast
 
-from psycopg2 import OperationalError
-from psycopg2 import connect as pg_connect
-from psycopg2.extensions import connection as pg_connection
-from psycopg2.extras import DictCursor, DictRow
-from redis import Redis
-from redis.exceptions import ConnectionError, RedisError
+from asyncpg import Pool, PostgresConnectionError, Record, create_pool
+from redis.asyncio import ConnectionPool, Redis
+from redis.exceptions import RedisError
 
 from .config.settings import settings
 from .exceptions import ConnectionFailedError
 
 
-def get_cursor(connection: pg_connection) -> DictCursor:
-    return cast(DictCursor, connection.cursor())
-
-
 class Connector(ABC):
     def __init__(self):
-        self.connection: pg_connection | Redis | None = None
+        self.connection: Pool | Redis | None = None
 
     @abstractmethod
-    def _connect(self) -> pg_connection | Redis:
+    async def _connect(self) -> Pool | Redis:
         ...
 
     @abstractmethod
-    def _ping(self):
+    async def _close(self):
         ...
 
-    def connect(self) -> pg_connection | Redis:
+    async def connect(self) -> Pool | Redis:
         if not self.connection:
-            self.connection = self._connect()
+            self.connection = await self._connect()
         return self.connection
 
-    def reconnect(self):
-        self.connection = self._connect()
-        self._ping()
+    async def close(self):
+        if not self.connection:
+            return
+
+        await self._close()
+        self.connection = None
 
 
 class PostgresConnector(Connector):
@@ -47,23 +41,29 @@ class PostgresConnector(Connector):
         super().__init__()
         if not dsl:
             self.dsl = {
-                "dbname": settings.postgres_db,
+                "database": settings.postgres_db,
                 "user": settings.postgres_user,
                 "password": settings.postgres_password,
                 "host": settings.postgres_host,
-                "port": settings.postgres_port,
+                "port": int(settings.postgres_port),
             }
         else:
             self.dsl = dsl
 
-    def _ping(self):
-        self.connection: pg_connection
-        cursor = self.connection.cursor()
-        cursor.execute("SELECT 1;")
-        cursor.close()
+    async def _connect(self) -> Pool:
+        # pool replaces broken connections by itself
+        return cast(
+            Pool,
+            await create_pool(
+                **self.dsl,
+                min_size=settings.postgres_pool_min_size,
+                max_size=settings.postgres_pool_max_size,
+                max_inactive_connection_lifetime=settings.postgres_pool_max_inactive,
+            ),
+        )
 
-    def _connect(self) -> pg_connection:
-        return pg_connect(**self.dsl, cursor_factory=DictCursor)
+    async def _close(self):
+        await cast(Pool, self.connection).close()
 
 
 class RedisConnector(Connector):
@@ -78,77 +78,60 @@ class RedisConnector(Connector):
         else:
             self.port = port
 
-    def _ping(self):
-        self.connection.ping()  # type: ignore
-
-    def _connect(self) -> Redis:
-        return Redis(self.host, self.port, decode_responses=True)
-
-
-def backing_connect(connector: Connector) -> Callable:
-    def decorator(func: Callable):
-        @wraps(func)
-        def inner(*args, **kwargs):
-            wait = settings.first_nap
-            time_passed = 0
-            is_connected = True
-            while time_passed < settings.wait_up_to:
-                try:
-                    # trying to reconnect
-                    if not is_connected:
-                        connector.reconnect()  # type: ignore
-
-                    return func(*args, **kwargs)
-                except (OperationalError or ConnectionError or RedisError) as e:
-                    logging.error(e)
-                    is_connected = False
-                    time_passed += wait
-                    wait = (
-                        wait * settings.waiting_factor
-                        if wait < settings.waiting_interval
-                        else settings.waiting_interval
-                    )
-                    logging.debug(f"Sleeping for {wait} seconds")
-                    sleep(wait)
-            raise ConnectionFailedError("Waiting for connection exceeded limit")
-
-        return inner
-
-    return decorator
+    async def _connect(self) -> Redis:
+        pool = ConnectionPool(
+            host=self.host,
+            port=self.port,
+            max_connections=settings.redis_pool_max_size,
+            socket_keepalive=True,
+            decode_responses=True,
+            client_name="scheduler",
+        )
+        return Redis(connection_pool=pool)
+
+    async def _close(self):
+        await cast(Redis, self.connection).close(close_connection_pool=True)
 
 
 class ConnectionManager:
     def __init__(self, connector: Connector):
         self.connector = connector
-        self._connection = None
-
-    def back_connection(self) -> Callable:
-        return backing_connect(self.connector)
-
-    def get_connection(self) -> pg_connection | Redis:
-        if self._connection:
-            return self._connection
-
-        self._connection = self.back_connection()(self.connector.connect)()
-        return self._connection
-
-    @property
-    def connection(self) -> pg_connection | Redis | None:
-        return self.get_connection()
-
-    @connection.setter
-    def connection(self, connection: pg_connection | Redis | None):
-        self._connection = connection
 
-    def __exit__(self, *args):
-        if not self._connection:
-            return
+    async def with_retry(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        await func(*args, **kwargs), retrying with backoff while connection fails
+        """
 
-        self._connection.close()
-        self._connection = None  # type: ignore
+        wait_up_to = settings.wait_up_to
+        waiting_factor = settings.waiting_factor
+        waiting_interval = settings.waiting_interval
+
+        wait = settings.first_nap
+        time_passed = 0
+        while time_passed < wait_up_to:
+            try:
+                return await func(*args, **kwargs)
+            except (PostgresConnectionError, OSError, RedisError) as e:
+                logging.error(e)
+                time_passed += wait
+                wait = (
+                    wait * waiting_factor
+                    if wait < waiting_interval
+                    else waiting_interval
+                )
+                logging.debug("Sleeping for %s seconds", wait)
+                await sleep(wait)
+        raise ConnectionFailedError("Waiting for connection exceeded limit")
+
+    async def get_connection(self) -> Pool | Redis:
+        return await self.with_retry(self.connector.connect)
+
+    async def __aexit__(self, *args):
+        await self.connector.close()
         logging.debug("Closed connection")
 
-    def __enter__(self):
+    async def __aenter__(self):
+        await self.get_connection()
         return self
 
 
@@ -156,106 +139,65 @@ class RedisConnectionManager(ConnectionManager):
     def __init__(self, connector: RedisConnector):
         super().__init__(connector)
 
-    def get_connection(self) -> Redis:
-        return cast(Redis, super().get_connection())
+    async def get_connection(self) -> Redis:
+        return cast(Redis, await super().get_connection())
 
 
 class PostgresConnectionManager(ConnectionManager):
     def __init__(self, connector: PostgresConnector):
-        self.cursor_name_prefix = 1
         super().__init__(connector)
 
-    def get_connection(self) -> pg_connection:
-        return cast(pg_connection, super().get_connection())
+    async def get_connection(self) -> Pool:
+        return cast(Pool, await super().get_connection())
 
-    def cursor(self, itersize: int = 10000) -> DictCursor:
-        # prevent cursor name from bloating
-        if self.cursor_name_prefix > 10000000:
-            self.cursor_name_prefix = 1
+    async def _fetchall(self, sql: str, sql_vars: Iterable = ()) -> list[Record]:
+        pool = await self.get_connection()
+        return await pool.fetch(sql, *sql_vars)
 
-        if itersize < 1:
-            return self.back_connection()(self.get_connection().cursor)()
+    async def _fetchone(self, sql: str, sql_vars: Iterable = ()) -> Record | None:
+        pool = await self.get_connection()
+        return await pool.fetchrow(sql, *sql_vars)
 
-        # create server side cursor to limit memory use
-        cursor = self.back_connection()(self.get_connection().cursor)(
-            name=f"cursor_{self.cursor_name_prefix}"
-        )
+    async def _execute_sql(self, sql: str, sql_vars: Iterable = ()) -> str:
+        pool = await self.get_connection()
+        return await pool.execute(sql, *sql_vars)
 
-        self.cursor_name_prefix += 1
-
-        logging.debug(f"Created cursor {self.cursor_name_prefix}")
-        cursor.itersize = itersize
-        return cursor
-
-    def _execute(
-        self, cursor: DictCursor, sql: str, sql_vars: Any = None
-    ) -> DictCursor:
-        if not sql_vars:
-            cursor.execute(sql)
-        else:
-            cursor.execute(sql, sql_vars)
-        return cursor
-
-    def _fetchall(self, sql: str, sql_vars: Any = None) -> Iterable[DictRow]:
-        """
-        cursor.fetchall() with reconnect
-        """
-
-        with closing(self.cursor()) as cursor:
-            return self._execute(cursor, sql, sql_vars).fetchall()
-
-    def _fetchone(self, sql, sql_vars: Any = None, itersize: int = 1) -> DictRow | None:
-        with closing(self.cursor(itersize)) as cursor:
-            return self._execute(cursor, sql, sql_vars).fetchone()
-
-    def _fetchmany(
-        self, sql: str, size: int, sql_vars: Any = None, itersize: int = 0
-    ) -> Iterable[Iterable[DictRow]]:
-        with closing(self.cursor(itersize)) as cursor:
-            self._execute(cursor, sql, sql_vars)
-
-            while True:
-                rows = cursor.fetchmany(size)
-                if len(rows) > 0:
-                    yield rows
-                else:
-                    return
-
-    def _execute_sql(self, sql: str, sql_vars: Any = None):
-        with closing(self.cursor()) as cursor:
-            self._execute(cursor, sql, sql_vars)
-
-    def fetchall(
-        self, sql: str, sql_vars: Any = None, itersize: int = 0
-    ) -> Iterable[DictRow]:
+    async def fetchall(self, sql: str, sql_vars: Iterable = ()) -> list[Record]:
         """
-        cursor.fetchall() with reconnect
+        connection.fetch() with reconnect
         """
 
-        return self.back_connection()(self._fetchall)(sql, sql_vars, itersize)
+        return await self.with_retry(self._fetchall, sql, sql_vars)
 
-    def fetchone(
-        self, sql: str, sql_vars: Any = None, itersize: int = 0
-    ) -> Iterable[DictRow]:
+    async def fetchone(self, sql: str, sql_vars: Iterable = ()) -> Record | None:
         """
-        cursor.fetchone() with reconnect
+        connection.fetchrow() with reconnect
         """
 
-        return self.back_connection()(self._fetchone)(sql, sql_vars)
+        return await self.with_retry(self._fetchone, sql, sql_vars)
 
-    def fetchmany(self, sql: str, size: int, sql_vars: Any = None, itersize: int = 0):
-        """
-        cursor.fetchmany with reconnect and batch control
+    async def _copy_and_execute(
+        self, setup: str, table: str, records: Iterable[tuple], sql: str
+    ) -> str:
+        pool = await self.get_connection()
+        async with pool.acquire() as connection, connection.transaction():
+            await connection.execute(setup)
+            await connection.copy_records_to_table(table, records=records)
+            return await connection.execute(sql)
 
-        sql: str - SQL expression
-        size: int - number of rows to read
-        close: bool - close after first batch
-        intersize: int - if > 0, creates server-side cursor with
-            len(batch) == intersize
+    async def execute(self, sql: str, sql_vars: Iterable = ()) -> str:
+        return await self.with_retry(self._execute_sql, sql, sql_vars)
 
+    async def copy_and_execute(
+        self, setup: str, table: str, records: Iterable[tuple], sql: str
+    ) -> str:
         """
+        Run setup, COPY records into table and run sql in one transaction
 
-        return self.back_connection()(self._fetchmany)(sql, size, sql_vars, itersize)
+        setup: str - SQL creating the table, e.g. temporary one
+        table: str - table to COPY records into
+        records: Iterable[tuple] - rows in column order of the table
+        sql: str - SQL using the copied rows
+        """
 
-    def execute(self, sql: str, sql_vars: Any = None):
-        return self.back_connection()(self._execute_sql)(sql)
+        return await self.with_retry(self._copy_and_execute, setup, table, records, sql)
@@ -8,3 +8,7 @@ class DataInconsistentError(Error):
 
 class ConnectionFailedError(Error):
     ...
+
+
+class UnknownTableError(Error):
+    ...
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import NamedTuple
 from uuid import UUID
 
 from pydantic import BaseModel
@@ -9,7 +10,9 @@ class Entry(BaseModel):
     modified: datetime
 
 
-class CronEntry(BaseModel):
+class CronEntry(NamedTuple):
+    """Row of cron table, types are already enforced by db"""
+
     id: UUID
     modified: datetime
     status: str
@@ -1,18 +1,15 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Iterable
+from typing import AsyncIterator, Iterable
 
 from scheduler.config import settings
 
 from .connections import ConnectionManager, PostgresConnectionManager
-from .models import CronEntry
+from .models import CronEntry, Entry
 from .state import State
 
-
-def scan(tables, scanning_method) -> Iterable[tuple[str, Iterable, Iterable]]:
-    for table_name, items in tables:
-        for to_be_scheduled, to_be_deleted in scanning_method(table_name, items):
-            yield table_name, to_be_scheduled, to_be_deleted
-    return
+# status column holds enum value, not the member
+_PENDING = settings.CronStatuses.PENDING.value
 
 
 class Producer(ABC):
@@ -27,52 +24,113 @@ class Producer(ABC):
         # this batch processed sucessfully
         self.not_processed_entities[table] = None
 
+    def drop_state(self, table: str):
+        # batches of the table will be read again on the next pass
+        self.state.discard(f"scheduler:{table}")
+
     @abstractmethod
-    def scan_table(self, table: str, items: int = 50) -> Iterable:
+    def scan_table(self, table: str, items: int = 50) -> AsyncIterator:
         ...
 
-    def scan(
-        self, tables: Iterable[tuple[str, int]] | None = None
-    ) -> Iterable[tuple[str, Iterable, Iterable]]:
-        return scan(tables, self.scan_table)
-
 
 class PostgresProducer(Producer):
+    # batches decoded ahead while the current one is processed
+    prefetch = 2
+
+    date_field = "updated_at"
+
     def __init__(self, state: State, manager: PostgresConnectionManager):
         super().__init__(state, manager)
         self.manager: PostgresConnectionManager = manager
-
-    def scan_table(
+        self.queries: dict[str, str] = {}
+
+    def query(self, table: str) -> str:
+        """
+        Page query of the table, built once
+
+        Same text every cycle lets asyncpg statement cache reuse the statement
+        prepared on each pool connection, so Postgres doesn't parse and plan it
+        again. PreparedStatement objects themselves are bound to a connection
+        and can't outlive its return to the pool.
+        """
+
+        if table not in self.queries:
+            date_field = self.date_field
+            # served by (updated_at, id) index, see migrations/
+            self.queries[table] = (
+                f"select {date_field}, id, status, cron_str from {table} "
+                f"where ({date_field}, id) > ($1, $2) "
+                f"order by {date_field}, id limit $3;"
+            )
+        return self.queries[table]
+
+    def split(
+        self, rows: Iterable
+    ) -> tuple[list[CronEntry], list[CronEntry], CronEntry]:
+        to_be_scheduled = []
+        to_be_deleted = []
+
+        # row is (modified, id, status, cron_str), as selected in scan_table
+        for row in rows:
+            entry = CronEntry(row[1], row[0], row[2], row[3])
+            if row[2] == _PENDING:
+                to_be_scheduled.append(entry)
+            else:
+                to_be_deleted.append(entry)
+
+        return to_be_scheduled, to_be_deleted, entry
+
+    async def read_batches(
+        self, queue: asyncio.Queue, sql: str, pack_size: int, state: Entry
+    ):
+        try:
+            # keyset pagination: every page starts right after the previous one
+            modified, last_id = state.modified, state.id
+            while rows := await self.manager.fetchall(
+                sql, (modified, last_id, pack_size)
+            ):
+                batch = self.split(rows)
+                await queue.put(batch)
+                if len(rows) < pack_size:
+                    break
+                modified, last_id = batch[2].modified, batch[2].id
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            # handing the error over to the consumer, scheduler errors are
+            # BaseException too
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    async def scan_table(
         self, table: str, pack_size: int
-    ) -> Iterable[tuple[Iterable, Iterable]]:
-        state = self.state.get_state(f"scheduler:{table}")
-        date_field = "updated_at"
+    ) -> AsyncIterator[tuple[Iterable, Iterable]]:
+        state = await self.state.get_state(f"scheduler:{table}")
+        # producer outlives a cycle, so start every scan from the stored state
+        self.not_processed_entities[table] = None
+        sql = self.query(table)
 
-        sql = (
-            f"select {date_field}, id, status, cron_str from {table} where {date_field} >= '{state.modified}' "
-            f"and id >= '{state.id}' order by {date_field} asc, id asc;"
-        )
+        # next batch is fetched and decoded while the consumer handles this one
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.prefetch)
+        reader = asyncio.create_task(self.read_batches(queue, sql, pack_size, state))
 
-        for rows in self.manager.fetchmany(sql, pack_size, itersize=5000):
-            to_be_scheduled = []
-            to_be_deleted = []
+        try:
+            while (batch := await queue.get()) is not None:
+                if isinstance(batch, BaseException):
+                    raise batch
 
-            for row in rows:
-                entry = CronEntry(
-                    modified=row[0], id=row[1], status=row[2], cron_str=row[3]
-                )
-                if entry.status == settings.CronStatuses.PENDING:
-                    to_be_scheduled.append(entry)
-                else:
-                    to_be_deleted.append(entry)
+                to_be_scheduled, to_be_deleted, last_entry = batch
 
-            # Processing didn't go on happy path
+                # Processing didn't go on happy path
 
-            if self.not_processed_entities.get(table):
-                return
+                if self.not_processed_entities.get(table):
+                    return
 
-            # Remembering current batch
+                # Remembering current batch
 
-            self.not_processed_entities[table] = rows[-1]
+                self.not_processed_entities[table] = last_entry
 
-            yield to_be_scheduled, to_be_deleted
+                yield to_be_scheduled, to_be_deleted
+        finally:
+            reader.cancel()
@@ -1,39 +1,168 @@
 import abc
+import logging
+import os
+import re
 import typing
+from uuid import UUID
 
-import crontab
-
-from config.settings import settings
 from scheduler import models
 
+from .config.settings import settings
+
+# five fields or a nickname, nothing that could end the line
+CRON_STR = re.compile(
+    r"(@(reboot|yearly|annually|monthly|weekly|daily|midnight|hourly))"
+    r"|([0-9A-Za-z*/,-]+([ \t]+[0-9A-Za-z*/,-]+){4})"
+)
+
+
+def is_job_id(token: str) -> bool:
+    try:
+        return str(UUID(token)) == token
+    except ValueError:
+        return False
+
 
 class Scheduler(abc.ABC):
     @abc.abstractmethod
-    def schedule(self, entries: typing.Iterable[models.CronEntry]):
+    def apply(
+        self,
+        to_delete: typing.Iterable[models.CronEntry],
+        to_add: typing.Iterable[models.CronEntry],
+    ):
         ...
 
     @abc.abstractmethod
-    def unschedule(self, entries: typing.Iterable[models.CronEntry]):
+    def flush(self):
         ...
 
     @abc.abstractmethod
     def generate_command(self, entry: models.CronEntry) -> str:
         ...
 
-
-class NotificationScheduler(Scheduler):
     def schedule(self, entries: typing.Iterable[models.CronEntry]):
-        tab = crontab.CronTab(user=True)
-        for entry in entries:
-            tab.new(self.generate_command(entry), str(entry.id)).setall(entry.cron_str)
-        tab.write()
+        self.apply((), entries)
 
     def unschedule(self, entries: typing.Iterable[models.CronEntry]):
-        tab = crontab.CronTab(user=True)
-        for entry in entries:
-            tab.remove_all(comment=str(entry.id))
+        self.apply(entries, ())
+
+
+class CronDFile:
+    """
+    In-memory copy of a cron.d file
+
+    Lines live in one buffer, index maps job id to its (start, end) span.
+    Removed lines stay in the buffer until the next flush compacts it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.buffer = bytearray()
+        self.index: dict[str, tuple[int, int]] = {}
+        self.garbage = 0
+        self.changed = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return
+
+        skipped = False
+        for line in lines:
+            if not line.strip() or line.startswith(b"#"):
+                continue
+            # job id is the last argument of the command
+            job_id = line.split()[-1].decode(errors="replace")
+            if not is_job_id(job_id):
+                # not ours, dropped on the next write
+                logging.warning("Skipped cron line %r", line)
+                skipped = True
+                continue
+            self.add(job_id, line.rstrip(b"\n") + b"\n")
+        # file matches the buffer unless lines were skipped
+        self.changed = skipped
+
+    def add(self, job_id: str, line: bytes):
+        span = self.index.get(job_id)
+        # re-read rows usually bring the same job, keep it and skip the rewrite
+        if span and self.buffer[span[0] : span[1]] == line:
+            return
+        self.remove(job_id)
+        start = len(self.buffer)
+        self.buffer += line
+        self.index[job_id] = (start, len(self.buffer))
+        self.changed = True
+
+    def remove(self, job_id: str):
+        span = self.index.pop(job_id, None)
+        if span:
+            self.garbage += span[1] - span[0]
+            self.changed = True
+
+    def compact(self):
+        # every add appends to the buffer, so index order is buffer order
+        buffer = bytearray()
+        for job_id, (start, end) in self.index.items():
+            self.index[job_id] = (len(buffer), len(buffer) + end - start)
+            buffer += self.buffer[start:end]
+        self.buffer = buffer
+        self.garbage = 0
+
+    def flush(self):
+        if not self.changed:
+            return
+        if self.garbage:
+            self.compact()
+
+        # cron skips file names with dots, so it won't pick up a half-written file
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(self.buffer)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+
+class NotificationScheduler(Scheduler):
+    def __init__(self, cron_file: CronDFile | None = None):
+        self.cron_file = cron_file or CronDFile(settings.cron_file)
+        # read once, lines are generated per entry
+        self.cron_user = settings.cron_user
+        self.cron_command = settings.cron_command
+
+    def apply(
+        self,
+        to_delete: typing.Iterable[models.CronEntry],
+        to_add: typing.Iterable[models.CronEntry],
+    ):
+        """
+        Unschedule and schedule entries, cron.d file is written on flush
+        """
+
+        for entry in to_delete:
+            self.cron_file.remove(str(entry.id))
+
+        for entry in to_add:
+            if not CRON_STR.fullmatch(entry.cron_str.strip(" ")):
+                # one bad line makes cron ignore the whole file
+                logging.error("Invalid cron_str %r of %s", entry.cron_str, entry.id)
+                self.cron_file.remove(str(entry.id))
+                continue
+            # rescheduled entry replaces its old job
+            self.cron_file.add(str(entry.id), self.generate_line(entry))
+
+    def flush(self):
+        self.cron_file.flush()
 
-        tab.write()
+    def generate_line(self, entry: models.CronEntry) -> bytes:
+        return (
+            f"{entry.cron_str} {self.cron_user} {self.generate_command(entry)}\n"
+        ).encode()
 
     def generate_command(self, entry: models.CronEntry) -> str:
-        return f"exec {settings.cron_command} {entry.id}"
+        return f"exec {self.cron_command} {entry.id}"
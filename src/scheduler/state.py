@@ -1,11 +1,43 @@
-import json
+import asyncio
+import logging
 from abc import ABC, abstractmethod
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Any
 from uuid import UUID
 
+import orjson
+from redis.asyncio.connection import Connection, ConnectionPool
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import RedisError, ResponseError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
 from .connections import ConnectionManager, RedisConnectionManager
-from .models import Entry
+from .models import CronEntry, Entry
+
+# hash of table -> state, old "etl_state" string key is left untouched
+STATE_KEY = "scheduler_state"
+INVALIDATE_CHANNEL = "__redis__:invalidate"
+# updated_at is timestamptz, asyncpg can't shift a naive year 1 date to UTC
+START_MODIFIED = datetime(1, 1, 1, tzinfo=timezone.utc)
+
+# Saves fields of KEYS[1] from ARGV pairs (field, json) atomically, a field
+# only moves forward by (modified, id). ISO timestamps of one column compare
+# as strings. Returns fields left untouched because the stored one is newer.
+SAVE_NEWER_SCRIPT = """
+local skipped = {}
+for i = 1, #ARGV, 2 do
+    local stored = redis.call('HGET', KEYS[1], ARGV[i])
+    local new = cjson.decode(ARGV[i + 1])
+    local old = stored and cjson.decode(stored)
+    if old and (old.modified > new.modified
+            or (old.modified == new.modified and old.id >= new.id)) then
+        table.insert(skipped, ARGV[i])
+    else
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+return skipped
+"""
 
 
 class BaseStorage(ABC):
@@ -13,42 +45,194 @@ class BaseStorage(ABC):
         self.conn_mann = conn_mann
 
     @abstractmethod
-    def save_state(self, state: dict[str, Any]):
+    async def save_fields(self, key: str, fields: dict[str, dict[str, Any]]):
         ...
 
     @abstractmethod
-    def retrieve_state(self) -> dict[str, Any]:
+    async def retrieve_field(self, key: str, field: str) -> dict[str, Any] | None:
         ...
 
 
 class RedisStorage(BaseStorage):
+    """
+    Redis hash storage with client-side caching
+
+    Fields are read and written through one connection with CLIENT TRACKING,
+    so Redis reports keys changed by other clients to a subscriber connection
+    and the cached fields of that key are dropped. NOLOOP keeps own writes
+    from invalidating the cache. If tracking isn't available (Redis < 6) or
+    its connections break, commands go through the pool uncached.
+    """
+
     def __init__(self, conn_mann: RedisConnectionManager):
         super().__init__(conn_mann)
-        self.redis = conn_mann.get_connection()
+        self.conn_mann: RedisConnectionManager = conn_mann
+        self.cache: dict[str, dict[str, dict[str, Any] | None]] = {}
+        # bumped on every invalidation, so a read racing with it isn't cached
+        self.generation = 0
+        self.tracked: Connection | None = None
+        self.tracking_supported = True
+        self.listener: asyncio.Task | None = None
+        self.lock = asyncio.Lock()
+        # tables read their state concurrently, tracking is started only once
+        self.tracking_lock = asyncio.Lock()
+
+    async def _call(self, connection: Connection, *args) -> Any:
+        await connection.send_command(*args)
+        return await connection.read_response()
+
+    async def start_tracking(self) -> bool:
+        if self.tracked:
+            return True
+        if not self.tracking_supported:
+            return False
+
+        async with self.tracking_lock:
+            # another caller could have started it while we waited
+            if self.tracked:
+                return True
+            if not self.tracking_supported:
+                return False
+            return await self._start_tracking()
+
+    async def _start_tracking(self) -> bool:
+        pool = (await self.conn_mann.get_connection()).connection_pool
+        connections = []
+        try:
+            subscriber = await pool.get_connection("SUBSCRIBE")
+            connections.append(subscriber)
+            tracked = await pool.get_connection("CLIENT")
+            connections.append(tracked)
+
+            client_id = await self._call(subscriber, "CLIENT", "ID")
+            await self._call(
+                tracked, "CLIENT", "TRACKING", "ON", "REDIRECT", client_id, "NOLOOP"
+            )
+            await self._call(subscriber, "SUBSCRIBE", INVALIDATE_CHANNEL)
+        except (RedisError, OSError) as e:
+            # ResponseError means the server has no CLIENT TRACKING
+            self.tracking_supported = not isinstance(e, ResponseError)
+            logging.debug("Client-side caching is off: %s", e)
+            for connection in connections:
+                await connection.disconnect()
+                await pool.release(connection)
+            return False
 
-    def save_state(self, state: dict[str, Any]):
-        serialized = json.dumps(state)
-        self.conn_mann.back_connection()(self.redis.set)("etl_state", serialized)
+        self.tracked = tracked
+        self.listener = asyncio.create_task(self.listen(pool, subscriber, tracked))
+        return True
 
-    def retrieve_state(self) -> dict[str, Any]:
-        serialized = self.conn_mann.back_connection()(self.redis.get)("etl_state")
-        if not serialized:
-            return {}
-        return json.loads(serialized)
+    def stop_tracking(self):
+        self.tracked = None
+        self.cache.clear()
+        self.generation += 1
+        if self.listener:
+            self.listener.cancel()
+            self.listener = None
+
+    async def listen(
+        self, pool: ConnectionPool, subscriber: Connection, tracked: Connection
+    ):
+        try:
+            while True:
+                response = await subscriber.read_response()
+                # only ["message", channel, keys] carries invalidations
+                if not isinstance(response, list) or len(response) != 3:
+                    continue
+                kind, _, keys = response
+                if kind != "message":
+                    continue
+
+                self.generation += 1
+                # no keys means the whole db was flushed
+                if keys is None:
+                    self.cache.clear()
+                    continue
+                for key in keys:
+                    self.cache.pop(key, None)
+        except (RedisError, OSError) as e:
+            logging.error(e)
+        finally:
+            # invalidations can't reach us anymore
+            if self.tracked is tracked:
+                self.listener = None
+                self.stop_tracking()
+            for connection in (subscriber, tracked):
+                await connection.disconnect()
+                await pool.release(connection)
+
+    async def execute(self, *args) -> Any:
+        if await self.start_tracking():
+            try:
+                async with self.lock:
+                    # tracking could have stopped while waiting for the lock
+                    tracked = self.tracked
+                    if tracked:
+                        return await self._call(tracked, *args)
+            except (RedisConnectionError, RedisTimeoutError, OSError) as e:
+                logging.error(e)
+                self.stop_tracking()
+
+        redis = await self.conn_mann.get_connection()
+        return await self.conn_mann.with_retry(redis.execute_command, *args)
+
+    async def save_fields(self, key: str, fields: dict[str, dict[str, Any]]):
+        if not fields:
+            return
+
+        # one script call for all the pairs is a single atomic round-trip, so
+        # a process writing an older state can't overwrite a newer one
+        pairs = []
+        for field, value in fields.items():
+            pairs += [field, orjson.dumps(value)]
+        skipped = await self.execute("EVAL", SAVE_NEWER_SCRIPT, 1, key, *pairs)
+        if self.tracked:
+            cached = self.cache.setdefault(key, {})
+            cached.update(fields)
+            for field in skipped:
+                cached.pop(field, None)
+
+    async def retrieve_field(self, key: str, field: str) -> dict[str, Any] | None:
+        fields = self.cache.get(key, {})
+        if field in fields:
+            return fields[field]
+
+        generation = self.generation
+        serialized = await self.execute("HGET", key, field)
+        value = orjson.loads(serialized) if serialized else None
+        if self.tracked and generation == self.generation:
+            self.cache.setdefault(key, {})[field] = value
+        return value
 
 
 class State:
     def __init__(self, storage: BaseStorage):
         self.storage = storage
+        # kept until flush, so state isn't ahead of what's been applied
+        self.buffer: dict[str, Entry | CronEntry] = {}
+
+    def set_state(self, key: str, value: Entry | CronEntry):
+        self.buffer[key] = value
+
+    def discard(self, key: str):
+        self.buffer.pop(key, None)
 
-    def set_state(self, key: str, value: Entry):
-        state = self.storage.retrieve_state()
-        state[key] = value.json()
-        self.storage.save_state(state)
+    async def flush(self):
+        # only changed fields are written, no read-modify-write
+        await self.storage.save_fields(
+            STATE_KEY,
+            {
+                key: {"id": value.id, "modified": value.modified}
+                for key, value in self.buffer.items()
+            },
+        )
+        self.buffer.clear()
 
-    def get_state(self, key: str) -> Entry:
-        state = self.storage.retrieve_state()
-        value = state.get(key)
+    async def get_state(self, key: str) -> Entry:
+        value = await self.storage.retrieve_field(STATE_KEY, key)
         if not value:
-            return Entry(modified=datetime(1, 1, 1, 1, 1, 1, 1), id=UUID(int=0))
-        return Entry.parse_raw(value)
+            return Entry(modified=START_MODIFIED, id=UUID(int=0))
+        entry = Entry.parse_obj(value)
+        if entry.modified.tzinfo is None:
+            entry.modified = entry.modified.replace(tzinfo=timezone.utc)
+        return entry